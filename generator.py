@@ -40,7 +40,7 @@ class Position:
     Attributes:
         coordinate (tuple): tupla con las coordenadas de la Posicion.
         color (list): color del numero.
-        way (list): lista de conexiones.
+        way_id (int): identificador del camino en el registro de caminos (None si no tiene camino).
         number (int): numero del cuadrado.
         adjacents (list): lista de Posiciones adyacentes.
         ini (bool): indica si es el inicio del camino.
@@ -60,7 +60,7 @@ class Position:
         """
         self.coordinate = (posy, posx)  # columna, fila
         self.color = color
-        self.way = []
+        self.way_id = None
         self.number = number
         self.adjacents = []
         self.ini = False
@@ -76,7 +76,7 @@ class Position:
         """
         self.number = 1
         self.ini = False
-        self.way = []
+        self.way_id = None
         self.pair = self
         self.new = True
 
@@ -94,6 +94,155 @@ class Position:
                                        (self.coordinate[1] - pos.coordinate[1]) ** 2))))
 
 
+class Way:
+    """Clase camino.
+
+    Attributes:
+        way_id (int): identificador del camino.
+        positions (list): lista de Posiciones del camino.
+        color (list): color del camino.
+        ini (Position): Posicion de inicio del camino.
+        end (Position): Posicion final del camino.
+        length (int): longitud del camino.
+
+    """
+    def __init__(self, way_id, positions):
+        """Clase que describe un camino del puzzle.
+
+        Args:
+            way_id (int): identificador del camino.
+            positions (list): lista de Posiciones del camino.
+
+        """
+        self.way_id = way_id
+        self.positions = list(positions)
+        self.color = self.positions[0].color
+        self.ini = self.positions[0]
+        self.end = self.positions[-1]
+        self.length = len(self.positions)
+
+    def __repr__(self):
+        return "%s-%s[%s]" % (repr(self.ini.coordinate), repr(self.end.coordinate), self.length)
+
+
+class Ways:
+    """Clase registro de caminos.
+
+    Cada camino se guarda una sola vez y las Posiciones solo guardan su identificador.
+
+    Attributes:
+        ways (dict): caminos vivos por identificador.
+        lengths (dict): identificadores de los caminos vivos por longitud.
+        next_id (int): siguiente identificador libre.
+
+    """
+    def __init__(self):
+        """Clase que guarda los caminos del puzzle.
+
+        """
+        self.ways = {}
+        self.lengths = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.ways)
+
+    def add(self, positions):
+        """Registra un camino y asigna su identificador a sus Posiciones.
+
+        Args:
+            positions (list): lista de Posiciones del camino.
+
+        Returns:
+            Identificador del camino.
+
+        """
+        way_id = self.next_id
+        self.next_id += 1
+        way = Way(way_id, positions)
+        for pos in way.positions:  # los 1's reutilizados dejan de pertenecer a su camino anterior.
+            old = self.ways.pop(pos.way_id, None)
+            if old is not None:
+                self.lengths[old.length].discard(old.way_id)
+                for w in old.positions:
+                    if w.way_id == old.way_id:
+                        w.way_id = None
+        self.ways[way_id] = way
+        self.lengths.setdefault(way.length, set()).add(way_id)
+        for pos in way.positions:
+            pos.way_id = way_id
+        return way_id
+
+    def get(self, pos):
+        """Devuelve el camino de una Posicion.
+
+        Args:
+            pos (Position): Posicion de la que obtener el camino.
+
+        Returns:
+            El camino (Way) o None si la Posicion no tiene camino.
+
+        """
+        return self.ways.get(pos.way_id)
+
+    def length(self, pos):
+        """Devuelve la longitud del camino de una Posicion.
+
+        Args:
+            pos (Position): Posicion de la que obtener la longitud.
+
+        Returns:
+            Longitud del camino o 0 si la Posicion no tiene camino.
+
+        """
+        way = self.ways.get(pos.way_id)
+        return 0 if way is None else way.length
+
+    @staticmethod
+    def same(pos1, pos2):
+        """Indica si dos Posiciones pertenecen al mismo camino.
+
+        Args:
+            pos1 (Position): primera Posicion.
+            pos2 (Position): segunda Posicion.
+
+        Returns:
+            Booleano indicando si comparten camino.
+
+        """
+        return pos1.way_id is not None and pos1.way_id == pos2.way_id
+
+    def by_length(self, length):
+        """Devuelve los caminos vivos de una longitud.
+
+        Args:
+            length (int): longitud de los caminos.
+
+        Returns:
+            Lista de caminos (Way) con esa longitud.
+
+        """
+        return [self.ways[way_id] for way_id in self.lengths.get(length, ())]
+
+    def clear(self, way_id):
+        """Elimina un camino del registro y resetea sus Posiciones.
+
+        Args:
+            way_id (int): identificador del camino.
+
+        Returns:
+            Lista de Posiciones reseteadas (vacia si el camino no existe).
+
+        """
+        way = self.ways.pop(way_id, None)
+        if way is None:
+            return []
+        self.lengths[way.length].discard(way_id)
+        for pos in way.positions:
+            pos.clear()
+        return way.positions
+
+
 class Puzzle:
     """Clase puzzle
 
@@ -102,6 +251,7 @@ class Puzzle:
         initial (list): lista de Posiciones iniciales del Puzzle.
         candidate (list): lista de Posiciones candidatas del Puzzle.
         final (list): lista de Posiciones finales del Puzzle.
+        ways (Ways): registro de caminos del Puzzle.
 
     """
 
@@ -117,6 +267,7 @@ class Puzzle:
         self.initial = initial
         self.candidate = []
         self.final = []
+        self.ways = Ways()
 
     def initialice(self):
         """ Inicializa las lista de posiciones finales con los 1's que no tengan 1's adyacentes (en cruz) e
@@ -163,6 +314,16 @@ class Puzzle:
                 stats[str(pos.number)] = 1
         return stats
 
+    def snapshot(self):
+        """Copia las Posiciones finales y candidatas actuales para ver o escribir resultados parciales. Es una copia
+        y no las Posiciones porque estas siguen cambiando en las rondas siguientes.
+
+        Returns:
+            Lista de tuplas (coordenada, color, numero).
+
+        """
+        return [(pos.coordinate, tuple(pos.color), pos.number) for pos in self.final + self.candidate]
+
 
 class Generator:
     """Clase generador.
@@ -270,6 +431,7 @@ class Generator:
                 else:
                     break
             self.temporal_way[0].ini = True
+            self.puzzle.ways.add(self.temporal_way)
             for pos in self.temporal_way:
                 if pos is self.temporal_way[0]:
                     pos.pair = self.temporal_way[-1]
@@ -279,20 +441,19 @@ class Generator:
                     pos.number = len(self.temporal_way)
                 else:
                     pos.number = 0
-                pos.way = self.temporal_way.copy()
                 self.puzzle.final.append(pos)
             self.temporal_way.clear()
-        for pos1 in self.puzzle.final:  # reseteamos los menores que el numero generado.
-            if pos1.number < self.max_number and pos1 not in self.puzzle.candidate and pos1.number != 1 and\
-                                    self.max_number > len(pos1.way) > 0:
-                for w in pos1.way:
-                    w.clear()
-            elif pos1.number == self.max_number:  # opciones de velocidad.
-                for pa in self.puzzle.final:
-                    if pa.euclides(pos1) <= self.max_number - self.speed and pa is not pos1 and pa is not pos1.pair and\
-                                    pa.number == pos1.number and pa.color == pos1.color:
-                        for w in pa.way:
-                            w.clear()
+        for length in range(2, self.max_number):  # reseteamos los menores que el numero generado.
+            for way in self.puzzle.ways.by_length(length):
+                self.puzzle.ways.clear(way.way_id)
+        for pos1 in self.puzzle.final:
+            if pos1.number == self.max_number:  # opciones de velocidad.
+                for way in self.puzzle.ways.by_length(self.max_number):
+                    for pa in (way.ini, way.end):
+                        if pa.euclides(pos1) <= self.max_number - self.speed and pa is not pos1 and\
+                           pa is not pos1.pair and pa.number == pos1.number and pa.color == pos1.color:
+                            self.puzzle.ways.clear(pa.way_id)
+                            break
 
 
 class Checker:
@@ -310,18 +471,21 @@ class Checker:
         leng (int): longitud de la lista Manager.
         nocheck (Position): Posicion para no comprobar una vez se ha visto que no hay error de caso A.
         cores (int): number of cores to use.
+        errors (ListProxy): lista Manager donde los procesos guardan los errores encontrados.
 
     """
-    def __init__(self, puzzle, cores):
+    def __init__(self, puzzle, cores, errors=None):
         """Clase para generar el puzzle a partir de un Puzzle.
 
         Args:
             puzzle (Puzzle): Puzzle sobre el que comprobar la validez.
             cores (int): number of cores to use.
+            errors (ListProxy): lista Manager para los errores (por defecto la global).
 
         """
         self.puzzle = puzzle
         self.cores = cores
+        self.errors = mylist if errors is None else errors
         self.t = Tree(';', format=1)
         self.taux = Tree(';', format=1)
         self.number = 0
@@ -358,29 +522,34 @@ class Checker:
             root (Position): posicion desde la que se comienza a generar el arbol auxiliar.
 
         """
-        if len(mylist) != self.leng:
-            for error in mylist:
-                for w in self.puzzle.final[error].way:
-                    w.clear()
-            self.leng = len(mylist)
+        if len(self.errors) != self.leng:
+            for error in self.errors:
+                self.puzzle.ways.clear(self.puzzle.final[error].way_id)
+            self.leng = len(self.errors)
+        ways = self.puzzle.ways
         dist = self.t.get_distance(self.t.get_tree_root(), rama)
+        aux2 = False
+        if self.number != 2:
+            for way_id in ways.lengths.get(self.number, ()):  # para mejorar la velocidad.
+                way = ways.ways[way_id]
+                for test in (way.ini, way.end):
+                    if test is not root and test.euclides(father) <= root.number - dist and\
+                            test not in self.nocheck:
+                        aux2 = True
+                        break
+                if aux2:
+                    break
         for adj in father.adjacents:
             if self.number == 2:
                 if dist != self.number and root.color == adj.color:
                     self.three_check(adj, rama.add_child(name=adj), root)
             else:
-                aux2 = False
-                for test in self.puzzle.final:  # para mejorar la velocidad.
-                    if test is not root and test.number == self.number and test.euclides(father) <= root.number - dist\
-                            and test not in self.nocheck:
-                        aux2 = True
-                        break
                 if aux2:
                     if (self.number > 3 and (dist < self.number - 1 and adj.number == 0) or (
                                     dist == self.number - 1 and adj.number == self.number)) or\
                        (self.number <= 3 and (dist < self.number - 1 and
-                                              ((adj.number == 0 and len(adj.way) == 0) or
-                                               (adj.number == 0 and len(adj.way) == self.number))) or
+                                              ((adj.number == 0 and ways.length(adj) == 0) or
+                                               (adj.number == 0 and ways.length(adj) == self.number))) or
                        (dist == self.number - 1 and adj.number == self.number)):
                         aux = [a.name for a in rama.iter_ancestors()]
                         if adj not in aux:  # para que no vuelva sobre si mismo.
@@ -393,7 +562,7 @@ class Checker:
             aux.append(father)
             if father is not root.pair and father.pair.euclides(root.pair) <= root.number - 1 and\
                father.color == root.color:
-                casea = sum((a.number == 0 and (len(a.way) == 0 or (len(a.way) == self.number and
+                casea = sum((a.number == 0 and (ways.length(a) == 0 or (ways.length(a) == self.number and
                                                                     a.color == root.color))) for a in aux)
                 if casea == self.number - 2:
                     self.case_a_aux(father.pair, self.taux.add_child(name=father.pair), root)
@@ -401,31 +570,31 @@ class Checker:
                         self.nocheck.append(root)
                     self.taux = Tree(';', format=1)
             elif father is root.pair:
-                only = sum(a in root.way for a in aux)
-                caseb = sum((a.number == 0 and (len(a.way) == 0 or a in root.way)) for a in aux)
+                only = sum(ways.same(a, root) for a in aux)
+                caseb = sum((a.number == 0 and (ways.length(a) == 0 or ways.same(a, root))) for a in aux)
                 casec = None
                 if self.number > 3:
                     for a in aux:
-                        if len(a.way) != self.number and len(a.way) > 3:
+                        if ways.length(a) != self.number and ways.length(a) > 3:
                             casec = a
                             break
                 if casec is not None:
                     for a in aux:
-                        if not (a in root.way or a in casec.way or (a.number == 0 and len(a.way) == 0)):
+                        if not (ways.same(a, root) or ways.same(a, casec) or (a.number == 0 and ways.length(a) == 0)):
                             casec = None
                             break
                 if only == self.number:
                     self.casee += 1
                     if self.casee > 1:
                         # print('error E encontrado', root)
-                        mylist.append(self.puzzle.final.index(root))
+                        self.errors.append(self.puzzle.final.index(root))
                         self.finish = True
                 elif caseb == self.number - 2:
                     # print('error B encontrado:', root)
-                    mylist.append(self.puzzle.final.index(root))
+                    self.errors.append(self.puzzle.final.index(root))
                     self.finish = True
                 elif casec is not None:
-                    ncaseci = [elem for elem in casec.way if elem.number != 0 and elem.ini][0]
+                    ncaseci = ways.get(casec).ini
                     self.case_c_aux(ncaseci, self.taux.add_child(name=ncaseci), root, ncaseci)
                     self.taux = Tree(';', format=1)
         rama.detach()
@@ -439,11 +608,11 @@ class Checker:
             root (Position): posicion desde la que se comienza a generar el arbol auxiliar.
 
         """
-        if len(mylist) != self.leng:
-            for error in mylist:
-                for w in self.puzzle.final[error].way:
-                    w.clear()
-            self.leng = len(mylist)
+        if len(self.errors) != self.leng:
+            for error in self.errors:
+                self.puzzle.ways.clear(self.puzzle.final[error].way_id)
+            self.leng = len(self.errors)
+        ways = self.puzzle.ways
         dist = self.taux.get_distance(self.taux.get_tree_root(), rama)
         for adj in father.adjacents:
             if self.number == 2 and root.color == adj.color:
@@ -451,8 +620,8 @@ class Checker:
                     self.case_a_aux(adj, rama.add_child(name=adj), root)
             else:
                 if father.euclides(root.pair) <= root.number - dist:
-                    if (dist < self.number - 1 and ((adj.number == 0 and len(adj.way) == 0) or
-                                                    (adj.number == 0 and len(adj.way) == self.number)))\
+                    if (dist < self.number - 1 and ((adj.number == 0 and ways.length(adj) == 0) or
+                                                    (adj.number == 0 and ways.length(adj) == self.number)))\
                             or (dist == self.number - 1 and adj.number == self.number):
                         aux = [a.name for a in rama.iter_ancestors()]
                         if adj not in aux:  # para que no vuelva sobre si mismo.
@@ -463,7 +632,7 @@ class Checker:
         elif father.number == self.number and dist == self.number and \
                 father is root.pair and father.color == root.color:
             # print('error A encontrado:', root)
-            mylist.append(self.puzzle.final.index(root))
+            self.errors.append(self.puzzle.final.index(root))
             self.finish = True
         rama.detach()
 
@@ -477,17 +646,17 @@ class Checker:
             ncasec (Position): posicion del caso c (auxiliar).
 
         """
-        if len(mylist) != self.leng:
-            for error in mylist:
-                for w in self.puzzle.final[error].way:
-                    w.clear()
-            self.leng = len(mylist)
+        if len(self.errors) != self.leng:
+            for error in self.errors:
+                self.puzzle.ways.clear(self.puzzle.final[error].way_id)
+            self.leng = len(self.errors)
+        ways = self.puzzle.ways
         dist = self.taux.get_distance(self.taux.get_tree_root(), rama)
         for adj in father.adjacents:
             if father.euclides(ncasec.pair) <= ncasec.number - dist:
-                if (dist < ncasec.number - 1 and ((adj.number == 0 and len(adj.way) == 0) or
-                                                  (adj.number == 0 and adj in root.way) or
-                                                  (adj.number == 0 and adj in ncasec.way)))\
+                if (dist < ncasec.number - 1 and ((adj.number == 0 and ways.length(adj) == 0) or
+                                                  (adj.number == 0 and ways.same(adj, root)) or
+                                                  (adj.number == 0 and ways.same(adj, ncasec))))\
                         or (dist == ncasec.number - 1 and adj.number == ncasec.number):
                     aux = [a.name for a in rama.iter_ancestors()]
                     if adj not in aux:  # para que no vuelva sobre si mismo.
@@ -497,13 +666,13 @@ class Checker:
             return
         elif dist == ncasec.number and father is ncasec.pair:
             aux = [a.name for a in rama.iter_ancestors() if type(a.name) is Position]
-            only = sum(a in ncasec.way for a in aux)
+            only = sum(ways.same(a, ncasec) for a in aux)
             if not only == ncasec.number:
                 # print('error C encontrado:', root)
                 if ncasec.number > root.number:
-                    mylist.append(self.puzzle.final.index(root))
+                    self.errors.append(self.puzzle.final.index(root))
                 else:
-                    mylist.append(self.puzzle.final.index(ncasec))
+                    self.errors.append(self.puzzle.final.index(ncasec))
                 self.finish = True
         rama.detach()
 
@@ -535,11 +704,9 @@ class Checker:
         print('progreso:', aux, 'de', long, '( procesos activos', len(launched),  ')', ' '*40, end='\r')
         for p in launched:
             p.join()
-        while len(mylist) > 0:
-            error = mylist.pop()
-            for w in self.puzzle.final[error].way:
-                w.clear()
-                self.puzzle.candidate.append(w)
+        while len(self.errors) > 0:
+            error = self.errors.pop()
+            self.puzzle.candidate += self.puzzle.ways.clear(self.puzzle.final[error].way_id)
         self.found_error()
 
     def found_error(self):
@@ -557,12 +724,10 @@ class Checker:
                         break
             # aquellos que sean menores que el numero chequeado.
             elif pos1.number < self.number and pos1 not in self.puzzle.candidate and pos1.number != 1 and (
-                            self.number > len(pos1.way) > 0):
-                for w in pos1.way:
+                            self.number > self.puzzle.ways.length(pos1) > 0):
+                for w in self.puzzle.ways.clear(pos1.way_id):
                     if w is not pos1:
-                        w.clear()
                         self.puzzle.candidate.append(w)
-                pos1.clear()
                 self.puzzle.candidate.append(pos1)
         [self.puzzle.final.remove(pos1) for pos1 in self.puzzle.candidate if pos1 in self.puzzle.final]
         # salvar longitud y ver si no es menor que el anterior. Si es menor restaurar final.
@@ -612,23 +777,26 @@ def read_csv(fname):
     return Puzzle((nrows, ncolumns), position_list)  # creamos el Puzzle.
 
 
-def write_csv(puzzle):
+def write_csv(puzzle, fname='temp.csv'):
     """Escribe la tabla pasada de un Puzzle en un archivo csv. Primero debe ordenar la lista por sus coordenadas,
+    se escribe en un archivo temporal que luego sustituye al final para que nunca se lea a medio escribir.
 
     Args:
         puzzle (Puzzle): Puzzle a escribir.
+        fname (str): archivo a escribir.
 
     """
-    file = open("temp.csv", 'w')
-    ncolumn = 0
-    for pos1 in sorted(puzzle.final, key=lambda position: (position.coordinate[1], position.coordinate[0])):
-        file.write(str(pos1.number))
-        ncolumn += 1
-        if ncolumn == puzzle.size[1]:
-            file.write('\n')
-            ncolumn = 0
-        else:
-            file.write(',')
+    with open(fname + '.tmp', 'w') as file:
+        ncolumn = 0
+        for pos1 in sorted(puzzle.final, key=lambda position: (position.coordinate[1], position.coordinate[0])):
+            file.write(str(pos1.number))
+            ncolumn += 1
+            if ncolumn == puzzle.size[1]:
+                file.write('\n')
+                ncolumn = 0
+            else:
+                file.write(',')
+    os.replace(fname + '.tmp', fname)
 
 
 def read_json(fname):
@@ -663,14 +831,15 @@ def read_json(fname):
     return Puzzle((nrows, ncolumns), position_list)
 
 
-def write_json(puzzle):
+def write_json(puzzle, fname='temp.json'):
     """Escribe la tabla pasada de un Puzzle en un archivo json. Primero debe ordenar la lista por sus coordenadas,
+    se escribe en un archivo temporal que luego sustituye al final para que nunca se lea a medio escribir.
 
     Args:
         puzzle (Puzzle): Puzzle a escribir.
+        fname (str): archivo a escribir.
 
     """
-    file = open("temp.json", 'w')
     ncolumn = 0
     row = []
     col = []
@@ -682,24 +851,107 @@ def write_json(puzzle):
             row.append(col)
             col = []
             ncolumn = 0
-    json.dump(row, file)
+    with open(fname + '.tmp', 'w') as file:
+        json.dump(row, file)
+    os.replace(fname + '.tmp', fname)
 
 
 def seconds_to_str(t):
     return str(timedelta(seconds=t))
 
 
-def main(arg1, arg2, arg3, arg4, arg5, arg6):
-    global start
-    if arg1.rsplit('/')[-1].rsplit('.')[1] == 'csv':
-        p = read_csv(os.path.abspath(os.path.dirname(arg1))+'/'+arg1.rsplit('/')[-1])
+def read_file(fname):
+    """Lee el archivo csv o json pasado segun su extension.
+
+    Args:
+        fname (str): archivo para ser leido.
+
+    Returns:
+        El Puzzle leido.
+
+    """
+    if fname.rsplit('/')[-1].rsplit('.')[1] == 'csv':
+        return read_csv(os.path.abspath(os.path.dirname(fname))+'/'+fname.rsplit('/')[-1])
     else:
-        p = read_json(os.path.abspath(os.path.dirname(arg1))+'/'+arg1.rsplit('/')[-1])
-    p.initialice()  # inicializamos las listas candidata y final y los adyacentes.
-    it2 = int(arg2)  # numero maximo.
-    it1 = it = int(arg3)  # numero de iteraciones por numero.
-    g = Generator(p, it2, int(arg4), int(arg5))  # creamos el generador.
-    c = Checker(p, arg6)
+        return read_json(os.path.abspath(os.path.dirname(fname))+'/'+fname.rsplit('/')[-1])
+
+
+def write_file(fname, puzzle):
+    """Escribe el Puzzle en csv o json segun la extension del archivo leido.
+
+    Args:
+        fname (str): archivo del que se leyo el puzzle.
+        puzzle (Puzzle): Puzzle a escribir.
+
+    """
+    if fname.rsplit('/')[-1].rsplit('.')[1] == 'csv':
+        write_csv(puzzle)
+    else:
+        write_json(puzzle)
+
+
+def rebuild(size, positions):
+    """Construye un Puzzle para escribirlo a partir de una copia de sus Posiciones.
+
+    Args:
+        size (tuple): tamaño del puzzle.
+        positions (list): lista de tuplas (coordenada, color, numero).
+
+    Returns:
+        Puzzle cuya lista final contiene las Posiciones.
+
+    """
+    p = Puzzle(size, [])
+    p.final = [Position(coordinate[0], coordinate[1], color, number) for coordinate, color, number in positions]
+    return p
+
+
+def share_score(scores, lock, nround, score, behind):
+    """Comparte el numero de candidatos de una ronda con el resto de ejecuciones del portfolio.
+
+    Args:
+        scores (DictProxy): menor numero de candidatos visto en cada ronda.
+        lock (Lock): cerrojo para actualizar scores.
+        nround (int): ronda actual.
+        score (int): numero de candidatos de la ronda actual.
+        behind (float): margen relativo sobre el mejor a partir del cual la ejecucion va por detras.
+
+    Returns:
+        Booleano indicando si la ejecucion debe continuar.
+
+    """
+    with lock:
+        best = scores.get(nround)
+        if best is None or score < best:
+            scores[nround] = score
+            return True
+    return score <= best * (1 + behind)
+
+
+def rounds(p, max_number, iterations, speed, speed_number, cores, errors=None):
+    """Genera y comprueba el puzzle para cada numero desde max_number hasta 2, devolviendo una instantanea tras cada
+    ronda (generacion y comprobacion).
+
+    Args:
+        p (Puzzle): Puzzle ya inicializado.
+        max_number (int): numero maximo.
+        iterations (int): numero de iteraciones por numero.
+        speed (int): velocidad de generacion.
+        speed_number (int): numero hasta el que se aplica la velocidad.
+        cores (int): number of cores to use.
+        errors (ListProxy): lista Manager para los errores del Checker.
+
+    Yields:
+        Diccionario con el numero, la iteracion, la tabla actual (candidatos como 1's), las estadisticas, los
+        candidatos, el tiempo transcurrido, si es la ultima ronda, el tamaño y la copia de las Posiciones (para
+        escribirla con rebuild).
+
+    """
+    ini = timer()
+    it2 = max_number  # numero maximo.
+    it1 = it = iterations  # numero de iteraciones por numero.
+    g = Generator(p, it2, speed, speed_number)  # creamos el generador.
+    c = Checker(p, cores, errors)
     while it2 > 1:
         while it > 0:
             print('numero:', it2, '- iteracion:', it1 + 1 - it, 'de', it1)
@@ -710,18 +962,312 @@ def main(arg1, arg2, arg3, arg4, arg5, arg6):
             c.check()
             for neu in p.final:
                 neu.new = False
+            positions = p.snapshot()
+            grid = [[0] * p.size[1] for _ in range(p.size[0])]
+            stats = {}
+            for coordinate, color, number in positions:
+                grid[coordinate[1]][coordinate[0]] = number
+                stats[str(number)] = stats.get(str(number), 0) + 1
+            yield {'number': it2, 'iteration': it1 + 1 - it, 'grid': grid, 'stats': stats,
+                   'candidates': len(p.candidate), 'elapsed': timer() - ini,
+                   'done': len(p.candidate) == 0 or (it2 == 2 and it == 1), 'size': p.size, 'positions': positions}
             if len(p.candidate) == 0:
                 it2 = 0
                 break
             it -= 1
         it = it1
         it2 -= 1
-    p.final += p.candidate
-    print('stats:', p.show_stats())
-    if arg1.rsplit('/')[-1].rsplit('.')[1] == 'csv':
-        write_csv(p)
+
+
+def generate(p, max_number, iterations, speed, speed_number, cores, errors=None, scores=None, lock=None,
+             behind=0.2, partial=None):
+    """Genera y comprueba el puzzle para cada numero desde max_number hasta 2.
+
+    Args:
+        p (Puzzle): Puzzle ya inicializado.
+        max_number (int): numero maximo.
+        iterations (int): numero de iteraciones por numero.
+        speed (int): velocidad de generacion.
+        speed_number (int): numero hasta el que se aplica la velocidad.
+        cores (int): number of cores to use.
+        errors (ListProxy): lista Manager para los errores del Checker.
+        scores (DictProxy): mejores candidatos por ronda del portfolio (None si no hay portfolio).
+        lock (Lock): cerrojo para actualizar scores.
+        behind (float): margen relativo sobre el mejor para abandonar la ejecucion.
+        partial (str): archivo leido; si se pasa se escribe el resultado parcial tras cada ronda.
+
+    Returns:
+        Booleano indicando si ha terminado (False si se ha abandonado por ir por detras en el portfolio).
+
+    """
+    for nround, snapshot in enumerate(rounds(p, max_number, iterations, speed, speed_number, cores, errors)):
+        if partial is not None:
+            write_file(partial, rebuild(snapshot['size'], snapshot['positions']))
+        if snapshot['done']:
+            break
+        if scores is not None and not share_score(scores, lock, nround, snapshot['candidates'], behind):
+            print('abandonando ejecucion ( candidatos', snapshot['candidates'], ')')
+            return False
+    return True
+
+
+def portfolio_run(fname, max_number, iterations, speed, speed_number, cores, seed, errors, scores, lock, behind,
+                  results):
+    """Ejecucion del portfolio con su propia semilla. Si termina guarda su resultado en results.
+
+    Args:
+        fname (str): archivo csv o json.
+        max_number (int): numero maximo.
+        iterations (int): numero de iteraciones por numero.
+        speed (int): velocidad de generacion.
+        speed_number (int): numero hasta el que se aplica la velocidad.
+        cores (int): number of cores to use.
+        seed (int): semilla de la ejecucion.
+        errors (ListProxy): lista Manager para los errores del Checker.
+        scores (DictProxy): mejores candidatos por ronda.
+        lock (Lock): cerrojo para actualizar scores.
+        behind (float): margen relativo sobre el mejor para abandonar la ejecucion.
+        results (ListProxy): lista Manager con los resultados (puntuacion, semilla, tamaño, posiciones).
+
+    """
+    random.seed(seed)
+    p = read_file(fname)
+    p.initialice()
+    if generate(p, max_number, iterations, speed, speed_number, cores, errors, scores, lock, behind):
+        p.final += p.candidate
+        score = (len(p.candidate), p.show_stats().get('1', 0))  # menos candidatos y, a igualdad, menos 1's.
+        results.append((score, seed, p.size, [(pos.coordinate, pos.color, pos.number) for pos in p.final]))
+
+
+def portfolio(fname, max_number, iterations, speed, speed_number, cores, runs, behind=0.2):
+    """Lanza varias generaciones con semillas distintas a la vez y se queda con la de menos candidatos (y 1's).
+
+    Las ejecuciones comparten el mejor numero de candidatos de cada ronda y abandonan si van por detras.
+
+    Args:
+        fname (str): archivo csv o json.
+        max_number (int): numero maximo.
+        iterations (int): numero de iteraciones por numero.
+        speed (int): velocidad de generacion.
+        speed_number (int): numero hasta el que se aplica la velocidad.
+        cores (int): number of cores to use (se reparten entre las ejecuciones).
+        runs (int): numero de ejecuciones.
+        behind (float): margen relativo sobre el mejor para abandonar una ejecucion.
+
+    Returns:
+        El mejor Puzzle generado.
+
+    """
+    scores = manager.dict()
+    lock = manager.Lock()
+    results = manager.list()
+    errors = [manager.list() for _ in range(runs)]  # una por ejecucion; se guardan para que no se liberen.
+    seed = random.randrange(2 ** 32)
+    processes = []
+    for run in range(runs):
+        processes.append(mp.Process(target=portfolio_run, args=(
+            fname, max_number, iterations, speed, speed_number, max(1, cores // runs), seed + run, errors[run],
+            scores, lock, behind, results)))
+    for pr in processes:
+        pr.start()
+    for pr in processes:
+        pr.join()
+    if len(results) == 0:
+        print('portfolio: ninguna ejecucion ha terminado')
+        sys.exit()
+    score, seed, size, positions = min(results, key=lambda result: result[0])
+    print('portfolio: terminadas', len(results), 'de', runs, '/ mejor semilla:', seed, '( candidatos', score[0],
+          '/ unos', score[1], ')')
+    return rebuild(size, positions)
+
+
+def window(p, size):
+    """Busca en el Puzzle leido la ventana cuadrada con mas cuadrados con numero.
+
+    Args:
+        p (Puzzle): Puzzle leido (sin inicializar).
+        size (int): lado de la ventana.
+
+    Returns:
+        Tupla (fila, columna, filas, columnas) de la ventana.
+
+    """
+    nrows, ncolumns = min(size, p.size[0]), min(size, p.size[1])
+    step = max(1, size // 2)
+    best = None
+    for row in list(range(0, p.size[0] - nrows, step)) + [p.size[0] - nrows]:
+        for col in list(range(0, p.size[1] - ncolumns, step)) + [p.size[1] - ncolumns]:
+            ones = sum(p.initial[posx * p.size[1] + posy].number >= 1 for posx in range(row, row + nrows)
+                       for posy in range(col, col + ncolumns))
+            if best is None or ones > best[0]:
+                best = (ones, row, col)
+    return best[1], best[2], nrows, ncolumns
+
+
+def crop(p, row, col, nrows, ncolumns):
+    """Recorta una ventana del Puzzle leido.
+
+    Args:
+        p (Puzzle): Puzzle leido (sin inicializar).
+        row (int): primera fila de la ventana.
+        col (int): primera columna de la ventana.
+        nrows (int): filas de la ventana.
+        ncolumns (int): columnas de la ventana.
+
+    Returns:
+        Nuevo Puzzle (sin inicializar) con Posiciones nuevas.
+
+    """
+    position_list = []
+    for posx in range(row, row + nrows):
+        for posy in range(col, col + ncolumns):
+            pos = p.initial[posx * p.size[1] + posy]
+            position_list.append(Position(posy - col, posx - row, pos.color, pos.number))
+    return Puzzle((nrows, ncolumns), position_list)
+
+
+def signature(p, max_number, cores, target_time, target_ratio):
+    """Clave para reutilizar un ajuste en puzzles parecidos.
+
+    Args:
+        p (Puzzle): Puzzle inicializado.
+        max_number (int): numero maximo.
+        cores (int): number of cores to use.
+        target_time (int): tiempo objetivo en segundos (None si el objetivo es de calidad).
+        target_ratio (float): proporcion de candidatos restantes objetivo (None si el objetivo es de tiempo).
+
+    Returns:
+        Cadena con el tamaño, la proporcion de candidatos y los colores (aproximados), el numero maximo y el objetivo
+        (con los cores si es de tiempo, porque el tiempo depende de ellos).
+
+    """
+    colors = len(set(tuple(pos.color) for pos in p.candidate))
+    target = 't%d-c%d' % (target_time, cores) if target_time is not None else 'q%.2f' % target_ratio
+    return '%d-%.1f-%d-%d-%s' % (round(math.log2(len(p.initial))), len(p.candidate) / len(p.initial),
+                                 min(colors, 8), max_number, target)
+
+
+def tune(fname, p, max_number, cores, target_time=None, target_ratio=None, budget=60, size=20,
+         tuning='tuning.json'):
+    """Elige speed, speed_number e iterations con generaciones de prueba sobre un recorte del puzzle.
+
+    Las pruebas van de la configuracion mas rapida a la mas lenta hasta agotar el presupuesto. Para cada una se mide
+    el tiempo por numero y la proporcion de candidatos restantes y se estima el tiempo de la ejecucion completa a
+    partir del tiempo por numero. Las configuraciones que se comportan igual solo se prueban una vez.
+    La decision se guarda en el archivo tuning para reutilizarla en puzzles parecidos solo si cumple el objetivo.
+
+    Args:
+        fname (str): archivo csv o json.
+        p (Puzzle): Puzzle completo inicializado.
+        max_number (int): numero maximo.
+        cores (int): number of cores to use.
+        target_time (int): tiempo objetivo de la ejecucion completa en segundos.
+        target_ratio (float): proporcion de candidatos restantes objetivo.
+        budget (int): segundos totales para las pruebas.
+        size (int): lado del recorte.
+        tuning (str): archivo json con los ajustes guardados.
+
+    Returns:
+        Tupla (speed, speed_number, iterations).
+
+    """
+    key = signature(p, max_number, cores, target_time, target_ratio)
+    saved = {}
+    if os.path.exists(tuning):
+        with open(tuning, 'r') as f:
+            saved = json.load(f)
+    if key in saved:
+        print('ajuste guardado', key, ':', saved[key])
+        return saved[key]['speed'], saved[key]['speed_number'], saved[key]['iterations']
+    configs = []
+    seen = set()
+    for config in sorted(set((speed, speed_number, iterations) for speed in range(1, 6) for iterations in range(1, 4)
+                             for speed_number in (2, max(2, max_number // 2))),
+                         key=lambda config: (config[2] * (6 - config[0]), config[1])):
+        # con max_number <= speed_number Generator.set_speed ignora speed.
+        effective = (config[0] if max_number > config[1] else None, config[1], config[2])
+        if effective not in seen:
+            seen.add(effective)
+            configs.append(config)
+    if max_number < 2:
+        print('ajuste: nada que ajustar con numero maximo', max_number)
+        return configs[0]
+    base = read_file(fname)
+    area = window(base, size)
+    state = random.getstate()  # las pruebas no deben cambiar la secuencia aleatoria de quien llama.
+    seed = random.randrange(2 ** 32)
+    trials = []
+    end = timer() + budget
+    for speed, speed_number, iterations in configs:
+        if timer() >= end:
+            break
+        print('prueba: velocidad', speed, '- numero velocidad', speed_number, '- iteraciones', iterations)
+        sample = crop(base, *area)
+        sample.initialice()
+        candidates = len(sample.candidate)
+        if candidates == 0:
+            continue
+        random.seed(seed)  # misma semilla para que las pruebas sean comparables.
+        ini = timer()
+        levels = 0
+        for snapshot in rounds(sample, max_number, iterations, speed, speed_number, cores):
+            levels = max_number - snapshot['number'] + 1
+            if snapshot['done'] or timer() > end:
+                break
+        if not snapshot['done']:
+            print('abandonando prueba ( tiempo agotado )')
+            continue
+        level = (timer() - ini) / levels
+        trials.append({'speed': speed, 'speed_number': speed_number, 'iterations': iterations, 'level': level,
+                       'estimate': level * (max_number - 1) * len(p.candidate) / candidates,
+                       'ratio': len(sample.candidate) / candidates})
+    random.setstate(state)
+    if len(trials) == 0:
+        print('ajuste: ninguna prueba ha terminado, usando la configuracion mas rapida')
+        return configs[0]
+    if target_time is not None:
+        valid = [trial for trial in trials if trial['estimate'] <= target_time]
+        if valid:
+            best = min(valid, key=lambda trial: (trial['ratio'], trial['estimate']))
+        else:
+            best = min(trials, key=lambda trial: trial['estimate'])
+    else:
+        valid = [trial for trial in trials if trial['ratio'] <= target_ratio]
+        if valid:
+            best = min(valid, key=lambda trial: trial['estimate'])
+        else:
+            best = min(trials, key=lambda trial: (trial['ratio'], trial['estimate']))
+    if not valid:  # no se guarda para volver a ajustar la proxima vez (por ejemplo con mas presupuesto).
+        print('ajuste', key, ': ninguna prueba cumple el objetivo, usando la mas cercana', best)
+        return best['speed'], best['speed_number'], best['iterations']
+    print('ajuste', key, ':', best)
+    saved[key] = best
+    with open(tuning + '.tmp', 'w') as f:
+        json.dump(saved, f, indent=1)
+    os.replace(tuning + '.tmp', tuning)
+    return best['speed'], best['speed_number'], best['iterations']
+
+
+def main(arg1, arg2, arg3, arg4, arg5, arg6, arg7=1, arg8=None, arg9=None, arg10=60, arg11=False):
+    global start
+    p = None
+    if arg8 is not None or arg9 is not None:
+        p = read_file(arg1)
+        p.initialice()
+        arg4, arg5, arg3 = tune(arg1, p, int(arg2), arg6, arg8, arg9, int(arg10))
+        print('ajuste: velocidad', arg4, '- numero velocidad', arg5, '- iteraciones', arg3)
+    if int(arg7) > 1:
+        if arg11:
+            print('--partial no se usa con --portfolio: las ejecuciones se sobrescribirian')
+        p = portfolio(arg1, int(arg2), int(arg3), int(arg4), int(arg5), arg6, int(arg7))
     else:
-        write_json(p)
+        if p is None:
+            p = read_file(arg1)
+            p.initialice()  # inicializamos las listas candidata y final y los adyacentes.
+        generate(p, int(arg2), int(arg3), int(arg4), int(arg5), arg6, partial=arg1 if arg11 else None)
+        p.final += p.candidate
+    print('stats:', p.show_stats())
+    write_file(arg1, p)
     end = timer()
     print('='*40, seconds_to_str(end - start))
     start = timer()
@@ -731,6 +1277,18 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate puzzles for pypbp game.')
     parser.add_argument('--cores', action='store', type=int, metavar='cores', default=1,
                         help='number of cores to use (default: 1)')
+    parser.add_argument('--portfolio', action='store', type=int, metavar='runs', default=1,
+                        help='number of independently seeded generations run at once, keeping the best puzzle '
+                             '(default: 1)')
+    tuner = parser.add_mutually_exclusive_group()
+    tuner.add_argument('--tune-time', action='store', type=int, metavar='seconds', default=None,
+                       help='tune speed, speed_number and iterations for a full run of about this many seconds')
+    tuner.add_argument('--tune-quality', action='store', type=float, metavar='ratio', default=None,
+                       help='tune speed, speed_number and iterations for at most this ratio of remaining candidates')
+    parser.add_argument('--tune-budget', action='store', type=int, metavar='seconds', default=60,
+                        help='seconds spent on tuning trials (default: 60)')
+    parser.add_argument('--partial', action='store_true',
+                        help='write the output file after every round so it can be used before the end')
     parser.add_argument('file', action='store', type=str, metavar='file',
                         help='CSV or JSON file from which to generate the puzzle')
     parser.add_argument('max_number', action='store', type=int, metavar='max_number', default=2, nargs='?',
@@ -743,5 +1301,9 @@ if __name__ == '__main__':
     parser.add_argument('speed_number', action='store', type=int, metavar='speed_number', default=2, nargs='?',
                         help='number till argument speed is applied (default: 2)')
     args = parser.parse_args()  # (interface=True, iterations=1, max_number=2, speed=1, speed_number=2)
+    if vars(args).get('partial') and vars(args).get('portfolio') > 1:
+        parser.error('--partial can not be used with --portfolio (the runs would overwrite each other)')
     main(vars(args).get('file'), vars(args).get('max_number'), vars(args).get('iterations'),
-         vars(args).get('speed'), vars(args).get('speed_number'), vars(args).get('cores'))
+         vars(args).get('speed'), vars(args).get('speed_number'), vars(args).get('cores'),
+         vars(args).get('portfolio'), vars(args).get('tune_time'), vars(args).get('tune_quality'),
+         vars(args).get('tune_budget'), vars(args).get('partial'))